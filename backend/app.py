@@ -1,17 +1,30 @@
 # type: ignore
 # pyright: ignore
+import os
+
+# CUDA 캐싱 할당자 설정 (torch import 전에 설정해야 적용됨)
+# expandable_segments로 단편화를 줄이고, garbage_collection_threshold로 필요할 때만 캐시를 정리
+os.environ.setdefault(
+    "PYTORCH_CUDA_ALLOC_CONF",
+    "expandable_segments:True,garbage_collection_threshold:0.8,max_split_size_mb:512"
+)
+
 from fastapi import FastAPI, File, UploadFile, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from faster_whisper import WhisperModel
-import os
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+import ctranslate2
 import tempfile
 import shutil
 import logging
 from typing import Optional, List, Dict, Any
 import torch
-import io
 import gc
+import io
+import contextlib
+import functools
+import asyncio
 import time
 import threading
 import json
@@ -23,7 +36,8 @@ import urllib.parse
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Faster Whisper API", version="1.0.0")
+# orjson으로 응답 직렬화 (세그먼트/단어 타임스탬프가 많은 응답에서 stdlib json보다 빠름)
+app = FastAPI(title="Faster Whisper API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS 설정
 app.add_middleware(
@@ -34,45 +48,104 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 응답 압축 (단어 타임스탬프가 포함된 큰 JSON 응답에서 효과가 큼, 레벨 5는 속도/압축률 균형점)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # 모델 초기화 (전역 변수)
 model = None
 current_model_size = None
+current_device = None
+current_compute_type = None
 model_loading = False  # 모델 로딩 중인지 여부
 loading_lock = threading.Lock()  # 동시 로딩 방지
 
-# GPU 메모리 관리를 위한 타이머 변수들
-model_unload_timer = None
-last_activity_time = time.time()
+# 컴퓨트 타입 설정
+COMPUTE_TYPES = ["auto", "float16", "int8_float16", "int8", "float32"]
+# GPU에서 int8_float16(가중치 int8, 연산 fp16)을 자동 적용할 대형 모델
+INT8_FLOAT16_MODEL_PREFIXES = ("large", "distil-large", "medium")
+
+# 배치 추론 기본 설정
+DEFAULT_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 16  # 한 요청이 공유 GPU 메모리를 모두 차지하지 않도록 제한
+
+# CTranslate2 작업자 수 (모델이 동시에 처리할 수 있는 변환 수, 한 변환의 CPU 전처리(VAD/특징 추출)와 다른 변환의 GPU 추론을 겹침)
+NUM_WORKERS = int(os.environ.get("WHISPER_NUM_WORKERS", "2"))
+
+# GPU 배치 변환 동시 실행 제한
+MAX_CONCURRENT_TRANSCRIPTIONS = NUM_WORKERS  # 동시에 실행할 배치 변환 수 (CTranslate2 작업자 수와 맞춤)
+# uvicorn --limit-concurrency 값 (README의 서비스 실행 명령과 같은 값을 유지해야 함)
+LIMIT_CONCURRENCY = 16
+# 실행 중 + 대기 중인 배치 변환 최대 개수 (초과 시 503 반환)
+# uvicorn 동시 연결 제한보다 작게 두어 /status 등 다른 요청이 들어올 여유를 남김
+MAX_QUEUE_SIZE = LIMIT_CONCURRENCY - 4
+transcription_semaphore = None  # startup 시 asyncio.Semaphore로 초기화
+pending_transcriptions = 0
+
+# GPU 메모리 관리를 위한 타이머 변수들 (시스템 시계 변경에 영향받지 않도록 monotonic 사용)
+last_activity_time = time.monotonic()
 UNLOAD_DELAY = 3600  # 1시간 (초 단위)
+UNLOAD_CHECK_INTERVAL = 30  # 언로드 조건 확인 주기 (초 단위)
+unload_watchdog_task = None
+
+# 언로드 시 캐시된 GPU 메모리를 드라이버에 반환할지 여부 (기본값: 캐싱 할당자가 재사용)
+AGGRESSIVE_FREE = os.environ.get("WHISPER_AGGRESSIVE_FREE", "0") == "1"
+
+# 이 크기 이하의 업로드는 임시 파일 없이 메모리에서 바로 디코딩
+IN_MEMORY_UPLOAD_LIMIT = 50 * 1024 * 1024  # 50MB
+
+# 업로드 임시 파일 위치 (기본값: 시스템 임시 디렉터리)
+# 임시 파일은 IN_MEMORY_UPLOAD_LIMIT를 넘는 큰 파일에만 사용되므로 용량이 작은 tmpfs(/dev/shm)는 기본값으로 쓰지 않음
+UPLOAD_TEMP_DIR = os.environ.get("WHISPER_TMPDIR") or None
 
 # 설정 파일 경로
 SETTINGS_FILE = "/home/purestory/whisper/backend/whisper_settings.json"
 
-def load_settings():
-    """설정 파일에서 마지막 모델 설정을 로드합니다."""
+# 설정 기본값
+DEFAULT_SETTINGS = {"last_model": "base", "compute_type": "auto"}
+
+# 요청 처리 중에 사용하는 메모리 내 설정 상태 (startup 시 설정 파일에서 초기화, 변경 시에만 파일에 기록)
+server_state = dict(DEFAULT_SETTINGS)
+settings_dirty = False  # 파일 기록에 실패한 변경이 남아 있는지 여부 (다음 저장 시 다시 시도)
+
+def read_settings():
+    """설정 파일 내용을 읽어 반환합니다 (파일이 없거나 읽기 실패 시 기본값)."""
     try:
         if os.path.exists(SETTINGS_FILE):
             with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
                 settings = json.load(f)
-                return settings.get('last_model', 'base')
+            return {
+                "last_model": settings.get('last_model', DEFAULT_SETTINGS["last_model"]),
+                "compute_type": settings.get('compute_type', DEFAULT_SETTINGS["compute_type"])
+            }
     except Exception as e:
         logger.warning(f"Failed to load settings: {e}")
-    return 'base'  # 기본값
+    return dict(DEFAULT_SETTINGS)
 
-def save_settings(model_size: str):
-    """현재 모델 설정을 파일에 저장합니다."""
+def save_settings(model_size: str, compute_type: str = "auto"):
+    """현재 모델 설정을 저장합니다 (메모리 상태는 항상 갱신, 값이 바뀌었거나 이전 기록이 실패한 경우에만 파일에 기록)."""
+    global settings_dirty
+    
+    if not settings_dirty and server_state["last_model"] == model_size and server_state["compute_type"] == compute_type:
+        return
+    
+    # 파일 기록 성공 여부와 관계없이 메모리 상태는 바로 반영
+    server_state["last_model"] = model_size
+    server_state["compute_type"] = compute_type
+    settings_dirty = True
+    
     try:
-        settings = {'last_model': model_size}
+        settings = {'last_model': model_size, 'compute_type': compute_type}
         os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
         with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(settings, f, ensure_ascii=False, indent=2)
-        logger.info(f"Settings saved: last_model = {model_size}")
+        settings_dirty = False
+        logger.info(f"Settings saved: last_model = {model_size}, compute_type = {compute_type}")
     except Exception as e:
         logger.warning(f"Failed to save settings: {e}")
 
 def unload_model():
     """모델을 GPU 메모리에서 언로드합니다."""
-    global model, current_model_size, model_loading
+    global model, current_model_size, current_device, current_compute_type, model_loading
     
     with loading_lock:
         if model is not None:
@@ -87,28 +160,24 @@ def unload_model():
             
             model = None
             current_model_size = None
+            current_device = None
+            current_compute_type = None
             model_loading = False
             
-            # 강화된 GPU 메모리 정리
+            # GPU 메모리 정리
             if torch.cuda.is_available():
-                # 강제 가비지 컬렉션
                 gc.collect()
                 
-                # GPU 메모리 정리 (여러 번 실행)
-                torch.cuda.empty_cache()
-                torch.cuda.synchronize()  # GPU 작업 완료 대기
-                torch.cuda.empty_cache()  # 한 번 더 실행
+                # 캐시 반환은 비용이 크므로 WHISPER_AGGRESSIVE_FREE=1 인 경우에만 실행
+                if AGGRESSIVE_FREE:
+                    torch.cuda.empty_cache()
                 
-                # 추가적인 GPU 메모리 해제 시도
+                # 메모리 통계 초기화 (통계만 갱신하므로 비용이 작음)
                 if hasattr(torch.cuda, 'reset_peak_memory_stats'):
                     torch.cuda.reset_peak_memory_stats()
                 if hasattr(torch.cuda, 'reset_accumulated_memory_stats'):
                     torch.cuda.reset_accumulated_memory_stats()
                 
-                # 강제 가비지 컬렉션 한 번 더
-                gc.collect()
-                torch.cuda.empty_cache()
-                
                 # GPU 메모리 사용량 체크 (언로드 후)
                 after_memory = torch.cuda.memory_allocated()/1024**3
                 after_reserved = torch.cuda.memory_reserved()/1024**3
@@ -121,126 +190,199 @@ def unload_model():
             
             logger.info("Whisper model unloaded successfully")
 
-def schedule_model_unload():
-    """모델 언로드를 예약합니다."""
-    global model_unload_timer
-    
-    # 기존 타이머가 있다면 취소
-    if model_unload_timer is not None:
-        model_unload_timer.cancel()
-    
-    # 새 타이머 시작
-    model_unload_timer = threading.Timer(UNLOAD_DELAY, unload_model)
-    model_unload_timer.start()
-    logger.info(f"Model unload scheduled for {UNLOAD_DELAY} seconds from now")
-
 def reset_activity_timer():
-    """활동 타이머를 리셋하고 언로드 스케줄을 갱신합니다."""
+    """활동 시간을 갱신합니다 (언로드는 unload_watchdog이 처리)."""
     global last_activity_time
-    last_activity_time = time.time()
+    last_activity_time = time.monotonic()
+
+@functools.lru_cache(maxsize=None)
+def supported_cuda_compute_types():
+    """현재 GPU에서 CTranslate2가 지원하는 컴퓨트 타입 목록을 반환합니다."""
+    try:
+        return frozenset(ctranslate2.get_supported_compute_types("cuda"))
+    except Exception as e:
+        logger.warning(f"Failed to query supported CUDA compute types: {e}")
+        return frozenset()
+
+def resolve_compute_type(model_size: str, device: str, compute_type: str) -> str:
+    """auto 컴퓨트 타입을 장치와 모델 크기에 맞게 결정합니다."""
+    if compute_type != "auto":
+        return compute_type
+    if device == "cuda":
+        # 대형 모델은 가중치를 int8로 양자화하여 VRAM과 메모리 대역폭을 절반으로 줄임 (WER 차이는 작음)
+        # int8을 지원하지 않는 GPU에서는 float16 사용
+        if model_size.startswith(INT8_FLOAT16_MODEL_PREFIXES) and "int8_float16" in supported_cuda_compute_types():
+            return "int8_float16"
+        return "float16"
+    return "int8"
+
+def load_model(model_size: str = "base", device: str = "auto", compute_type: Optional[str] = None):
+    """모델을 로드하고 (모델, 장치, 실제로 로드된 모델 크기)를 반환합니다. compute_type을 지정하지 않으면 저장된 설정을 사용합니다.
+
+    로드에 실패하여 더 작은 모델로 폴백한 경우 반환되는 모델 크기는 요청한 값과 다릅니다.
+    """
+    if compute_type is None:
+        compute_type = server_state["compute_type"]
+    
+    # 장치 설정
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
     
-    # 모델이 로드되어 있다면 언로드 타이머 재설정
-    if model is not None:
-        schedule_model_unload()
+    # 로딩 락 획득 (다른 요청이 로딩 중이면 대기)
+    # 모델과 파이프라인을 같은 락 안에서 함께 반환하여 다른 요청의 모델 교체와 섞이지 않도록 함
+    with loading_lock:
+        return load_model_locked(model_size, device, compute_type)
 
-def load_model(model_size: str = "base", device: str = "auto", compute_type: str = "auto"):
-    """모델을 로드합니다."""
-    global model, current_model_size, model_loading
+def load_model_locked(model_size: str, device: str, requested_compute_type: str, is_fallback: bool = False):
+    """loading_lock을 획득한 상태에서 모델을 로드합니다 (폴백 시 락을 다시 잡지 않도록 분리)."""
+    global model, current_model_size, current_device, current_compute_type, model_loading
+    
+    # 컴퓨트 타입 설정
+    compute_type = resolve_compute_type(model_size, device, requested_compute_type)
     
     # 이미 로드된 모델이 요청된 모델과 같으면 바로 반환
-    if model is not None and current_model_size == model_size:
+    if model is not None and current_model_size == model_size and current_compute_type == compute_type:
         reset_activity_timer()
-        return model
+        return model, current_device, current_model_size
     
-    # 로딩 락 획득 (다른 요청이 로딩 중이면 대기)
-    with loading_lock:
-        # 락을 획득한 후 다시 확인 (다른 스레드가 이미 로드했을 수 있음)
-        if model is not None and current_model_size == model_size:
-            reset_activity_timer()
-            return model
+    # 이미 로딩 중이면 대기 (실제로는 이 상황이 발생하지 않아야 함)
+    if model_loading:
+        logger.warning("Model is already loading, this should not happen")
+        return None, None, None
+    
+    try:
+        model_loading = True
+        logger.info(f"Starting to load model: {model_size}")
         
-        # 이미 로딩 중이면 대기 (실제로는 이 상황이 발생하지 않아야 함)
-        if model_loading:
-            logger.warning("Model is already loading, this should not happen")
-            return None
+        logger.info(f"Loading model: {model_size} on {device} with {compute_type}")
         
-        try:
-            model_loading = True
-            logger.info(f"Starting to load model: {model_size}")
-            
-            # 장치 설정
-            if device == "auto":
-                device = "cuda" if torch.cuda.is_available() else "cpu"
-            
-            # 컴퓨트 타입 설정
-            if compute_type == "auto":
-                if device == "cuda":
-                    compute_type = "float16"
-                else:
-                    compute_type = "int8"
-            
-            logger.info(f"Loading model: {model_size} on {device} with {compute_type}")
-            
-            # 기존 모델 언로드
-            if model is not None:
-                logger.info("Unloading previous model")
-                model = None
-                current_model_size = None
-                
-            # 강화된 GPU 메모리 정리
-            if torch.cuda.is_available():
-                gc.collect()
-                torch.cuda.empty_cache()
-                torch.cuda.synchronize()
-                torch.cuda.empty_cache()
-                gc.collect()
-            
-            # 새 모델 로드
-            model = WhisperModel(model_size, device=device, compute_type=compute_type)
-            current_model_size = model_size
-            model_loading = False
-            
-            logger.info(f"Model {model_size} loaded successfully")
-            
-            # 모델 설정 저장
-            save_settings(model_size)
-            
-            # 모델 로드 후 언로드 타이머 시작
-            schedule_model_unload()
-            
-            # 활동 타이머 리셋
-            reset_activity_timer()
-            
-            return model
-            
-        except Exception as e:
-            model_loading = False
-            logger.error(f"Error loading model: {str(e)}")
-            
-            # 로드 실패 시 더 작은 모델로 폴백 (재귀 호출 방지)
-            if model_size.startswith('large') and not model_size.endswith('_fallback'):
-                logger.info("Falling back to medium model due to loading error")
-                return load_model("medium_fallback", device, compute_type)
-            elif model_size.startswith('medium') and not model_size.endswith('_fallback'):
-                logger.info("Falling back to small model due to loading error")
-                return load_model("small_fallback", device, compute_type)
-            else:
-                raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}")
+        # 기존 모델 언로드
+        if model is not None:
+            logger.info("Unloading previous model")
+            model = None
+            current_model_size = None
+            current_device = None
+            current_compute_type = None
+        
+        # 새 모델 로드 (해제된 블록은 캐싱 할당자가 재사용)
+        model = WhisperModel(model_size, device=device, compute_type=compute_type, num_workers=NUM_WORKERS)
+        current_model_size = model_size
+        current_device = device
+        current_compute_type = compute_type
+        model_loading = False
+        
+        logger.info(f"Model {model_size} loaded successfully")
+        
+        # 모델 설정 저장 (일시적인 오류로 폴백된 모델은 사용자 선택으로 저장하지 않음)
+        if not is_fallback:
+            save_settings(model_size, requested_compute_type)
+        
+        # 활동 타이머 리셋
+        reset_activity_timer()
+        
+        return model, device, model_size
+        
+    except Exception as e:
+        model_loading = False
+        logger.error(f"Error loading model: {str(e)}")
+        
+        # 로드 실패 시 더 작은 모델로 폴백 (large → medium → small 순서로 한 번씩만 시도)
+        if model_size.startswith('large'):
+            logger.info("Falling back to medium model due to loading error")
+            return load_model_locked("medium", device, requested_compute_type, is_fallback=True)
+        elif model_size.startswith('medium'):
+            logger.info("Falling back to small model due to loading error")
+            return load_model_locked("small", device, requested_compute_type, is_fallback=True)
+        else:
+            raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}")
+
+def collect_segments(segments, word_timestamps: bool):
+    """변환 결과 세그먼트를 응답 형식으로 수집합니다."""
+    result_segments = []
+    full_text_parts: List[str] = []
+    total_characters = 0
+    
+    # faster-whisper는 타임스탬프/확률을 numpy.float64로 반환하는 경우가 있어 orjson이 직렬화할 수 있도록 float로 변환
+    for segment in segments:
+        stripped = segment.text.strip()
+        segment_data = {
+            "start": float(segment.start),
+            "end": float(segment.end),
+            "text": stripped
+        }
+        
+        if word_timestamps and hasattr(segment, 'words') and segment.words:
+            segment_data["words"] = []
+            for word in segment.words:
+                probability = getattr(word, 'probability', None)
+                segment_data["words"].append({
+                    "start": float(word.start),
+                    "end": float(word.end),
+                    "word": word.word,
+                    "probability": float(probability) if probability is not None else None
+                })
+        
+        result_segments.append(segment_data)
+        full_text_parts.append(stripped)
+        total_characters += len(stripped)
+    
+    # 문자열 누적 대신 마지막에 한 번만 합침
+    full_text = " ".join(full_text_parts)
+    
+    return result_segments, full_text, total_characters
+
+def run_batched_transcription(loaded_model, audio, batch_size: int, options):
+    """배치 파이프라인으로 변환하고 결과를 수집합니다 (작업 스레드에서 실행)."""
+    # 30초 청크를 묶어서 인코더/디코더에 전달하는 배치 파이프라인
+    # 파이프라인은 호출별 상태(last_speech_timestamp 등)를 인스턴스에 저장하므로 동시 요청끼리 공유하지 않고 요청마다 생성 (모델만 감싸므로 비용이 작음)
+    pipeline = BatchedInferencePipeline(model=loaded_model)
+    # 배치 파이프라인 기본값(without_timestamps=True)은 VAD 청크(최대 30초)마다 세그먼트 하나를 만들므로 타임스탬프 토큰 사용
+    segments, info = pipeline.transcribe(audio, batch_size=batch_size, without_timestamps=False, **options)
+    result_segments, full_text, total_characters = collect_segments(segments, options["word_timestamps"])
+    return result_segments, full_text, total_characters, info
+
+async def unload_watchdog():
+    """주기적으로 마지막 활동 시간을 확인하여 UNLOAD_DELAY 동안 사용되지 않은 모델을 언로드합니다."""
+    while True:
+        await asyncio.sleep(UNLOAD_CHECK_INTERVAL)
+        if model is not None and time.monotonic() - last_activity_time > UNLOAD_DELAY:
+            logger.info(f"Model idle for more than {UNLOAD_DELAY} seconds, unloading")
+            try:
+                await asyncio.to_thread(unload_model)
+            except Exception as e:
+                logger.error(f"Error unloading model: {str(e)}")
 
 @app.on_event("startup")
 async def startup_event():
     """서버 시작 시 초기화"""
+    global transcription_semaphore, unload_watchdog_task
+    
     # 저장된 설정 로드
-    last_model = load_settings()
+    settings = read_settings()
+    server_state["last_model"] = settings["last_model"]
+    server_state["compute_type"] = settings["compute_type"]
+    last_model = server_state["last_model"]
+    
+    # GPU 배치 변환 동시 실행 제한
+    transcription_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
+    
+    # 유휴 모델 언로드 감시 시작
+    unload_watchdog_task = asyncio.create_task(unload_watchdog())
+    
     logger.info(f"Whisper STT server started - last used model: {last_model} (will be loaded on first access)")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """서버 종료 시 백그라운드 작업 정리"""
+    if unload_watchdog_task is not None:
+        unload_watchdog_task.cancel()
+
 @app.get("/")
 async def root():
     """API 상태 확인"""
     # 웹페이지 접속은 활동으로 간주하지만 모델은 실제 사용시에만 로드
     # 단순히 활동 시간만 갱신
-    global last_activity_time
-    last_activity_time = time.time()
+    reset_activity_timer()
     
     return {"message": "Faster Whisper API is running", "status": "ok"}
 
@@ -255,7 +397,14 @@ async def get_available_models():
         "large-v1", "large-v2", "large-v3", "large-v3-turbo",
         "distil-large-v2", "distil-large-v3"
     ]
-    return {"models": models}
+    compute_types = {
+        "auto": "GPU: large/distil-large/medium 모델은 int8_float16 (GPU가 지원하는 경우), 그 외는 float16 / CPU: int8",
+        "float16": "GPU 기본 정밀도, 가장 높은 정확도",
+        "int8_float16": "가중치 int8 + 연산 float16, VRAM 절반 및 대형 모델에서 더 빠른 인코딩 (WER 차이 0.5 미만)",
+        "int8": "CPU 기본값, 메모리 사용량 최소",
+        "float32": "전체 정밀도, 가장 느리고 메모리 사용량 최대"
+    }
+    return {"models": models, "compute_types": compute_types}
 
 @app.post("/transcribe")
 async def transcribe_audio(
@@ -264,15 +413,18 @@ async def transcribe_audio(
     language: Optional[str] = None,
     word_timestamps: bool = False,
     beam_size: int = 5,
-    vad_filter: bool = True
+    vad_filter: bool = True,
+    batch_size: int = DEFAULT_BATCH_SIZE
 ):
+    global pending_transcriptions
+    
     # 활동 타이머 리셋
     reset_activity_timer()
     
     effective_model_size = model_size if model_size else current_model_size
     if not effective_model_size:
         # 저장된 설정에서 마지막 모델 사용
-        effective_model_size = load_settings()
+        effective_model_size = server_state["last_model"]
 
     logger.info(f"Received /transcribe request. Requested model_size: {model_size}, Effective model_size: {effective_model_size}")
     
@@ -284,109 +436,120 @@ async def transcribe_audio(
     if not file.filename:
         raise HTTPException(status_code=400, detail="파일명이 없습니다.")
     
-    # 임시 파일로 저장
-    temp_dir = tempfile.mkdtemp()
-    temp_file_path = None
+    # 배치 크기 범위 확인
+    if not 1 <= batch_size <= MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"batch_size는 1 이상 {MAX_BATCH_SIZE} 이하여야 합니다.")
     
-    try:
-        # 파일 확장자 추출
-        file_extension = os.path.splitext(file.filename)[1]
-        temp_file_path = os.path.join(temp_dir, f"audio{file_extension}")
-        
-        # 파일 저장
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        logger.info(f"Audio file saved: {temp_file_path}")
-        
-        # 모델 로드 (load_model에서 중복 체크 처리)
-        loaded_model = load_model(effective_model_size)
-        
-        if loaded_model is None:
-            raise HTTPException(status_code=500, detail="모델 로드에 실패했습니다")
-        
-        # 변환 옵션 설정
-        transcribe_options = {
-            "beam_size": beam_size,
-            "word_timestamps": word_timestamps,
-            "vad_filter": vad_filter
-        }
-        
-        if language:
-            transcribe_options["language"] = language
-        
-        logger.info(f"Starting transcription with model {effective_model_size}, options: {transcribe_options}")
-        
-        # 음성 변환 실행
-        segments, info = loaded_model.transcribe(temp_file_path, **transcribe_options)
-        
-        # 결과 수집
-        result_segments = []
-        full_text = ""
-        total_characters = 0
-        
-        for segment in segments:
-            segment_data = {
-                "start": segment.start,
-                "end": segment.end,
-                "text": segment.text.strip()
+    # 큰 파일만 임시 디렉터리에 저장 (종료 시 남은 파일까지 모두 재귀적으로 정리됨)
+    with contextlib.ExitStack() as cleanup:
+        try:
+            # 작은 파일은 메모리에서 바로 디코딩하여 임시 파일 쓰기/읽기를 생략
+            head = await file.read(IN_MEMORY_UPLOAD_LIMIT + 1)
+            if len(head) <= IN_MEMORY_UPLOAD_LIMIT:
+                audio_source = io.BytesIO(head)
+                logger.info(f"Audio file kept in memory: {len(head)} bytes")
+            else:
+                temp_dir = cleanup.enter_context(tempfile.TemporaryDirectory(dir=UPLOAD_TEMP_DIR))
+                
+                # 파일 확장자 추출
+                file_extension = os.path.splitext(file.filename)[1]
+                temp_file_path = os.path.join(temp_dir, f"audio{file_extension}")
+                
+                # 파일 저장 (이벤트 루프를 막지 않도록 작업 스레드에서 복사)
+                with open(temp_file_path, "wb") as buffer:
+                    await asyncio.to_thread(buffer.write, head)
+                    await asyncio.to_thread(shutil.copyfileobj, file.file, buffer)
+                
+                audio_source = temp_file_path
+                logger.info(f"Audio file saved: {temp_file_path}")
+            del head
+            
+            # 모델 로드 (load_model에서 중복 체크 처리, 로딩 중에도 다른 요청을 처리하도록 작업 스레드에서 실행)
+            loaded_model, loaded_device, loaded_model_size = await asyncio.to_thread(load_model, effective_model_size)
+            
+            if loaded_model is None:
+                raise HTTPException(status_code=500, detail="모델 로드에 실패했습니다")
+            
+            # 변환 옵션 설정
+            transcribe_options = {
+                "beam_size": beam_size,
+                "word_timestamps": word_timestamps,
+                "vad_filter": vad_filter
             }
             
-            if word_timestamps and hasattr(segment, 'words') and segment.words:
-                segment_data["words"] = [
-                    {
-                        "start": word.start,
-                        "end": word.end,
-                        "word": word.word,
-                        "probability": getattr(word, 'probability', None)
-                    }
-                    for word in segment.words
-                ]
+            if language:
+                transcribe_options["language"] = language
             
-            result_segments.append(segment_data)
-            full_text += segment.text.strip() + " "
-            total_characters += len(segment.text.strip())
-        
-        # 초당 변환 글자 개수 계산
-        characters_per_second = total_characters / info.duration if info.duration > 0 else 0
-        
-        # 응답 데이터 구성
-        response_data = {
-            "text": full_text.strip(),
-            "segments": result_segments,
-            "language": info.language,
-            "language_probability": info.language_probability,
-            "duration": info.duration,
-            "total_characters": total_characters,
-            "characters_per_second": round(characters_per_second, 2),
-            "model_size": effective_model_size,
-            "options": transcribe_options
-        }
-        
-        logger.info(f"Transcription completed. Language: {info.language}, Duration: {info.duration}s, Characters: {total_characters}, CPS: {characters_per_second:.2f}, Model: {effective_model_size}")
+            # 배치 추론은 GPU에서만 사용 (CPU/int8에서는 이점이 적음)
+            # 배치 파이프라인은 VAD로 청크를 나누므로 vad_filter=False 요청은 일반 경로로 처리
+            use_batched = (
+                batch_size > 1
+                and vad_filter
+                and loaded_device == "cuda"
+                and transcription_semaphore is not None
+            )
+            
+            logger.info(f"Starting transcription with model {loaded_model_size}, options: {transcribe_options}, batched: {use_batched} (batch_size={batch_size})")
+            
+            # 음성 변환 실행
+            if use_batched:
+                # 대기 중인 요청이 너무 많으면 거절
+                if pending_transcriptions >= MAX_QUEUE_SIZE:
+                    raise HTTPException(status_code=503, detail="대기 중인 변환 요청이 너무 많습니다. 잠시 후 다시 시도해주세요.")
+                
+                pending_transcriptions += 1
+                try:
+                    # 동시 실행 수를 제한하여 요청들이 GPU를 두고 경쟁하지 않도록 함
+                    async with transcription_semaphore:
+                        result_segments, full_text, total_characters, info = await asyncio.to_thread(
+                            run_batched_transcription, loaded_model, audio_source, batch_size, transcribe_options
+                        )
+                finally:
+                    pending_transcriptions -= 1
+            else:
+                segments, info = await asyncio.to_thread(loaded_model.transcribe, audio_source, **transcribe_options)
+                # segments는 순회할 때 실제 추론이 진행되는 제너레이터이므로 수집도 작업 스레드에서 실행
+                result_segments, full_text, total_characters = await asyncio.to_thread(collect_segments, segments, word_timestamps)
+            
+            # 초당 변환 글자 개수 계산
+            characters_per_second = total_characters / info.duration if info.duration > 0 else 0
+            
+            # 응답 데이터 구성
+            response_data = {
+                "text": full_text.strip(),
+                "segments": result_segments,
+                "language": info.language,
+                "language_probability": float(info.language_probability),
+                "duration": float(info.duration),
+                "total_characters": total_characters,
+                "characters_per_second": round(characters_per_second, 2),
+                "model_size": loaded_model_size,
+                "options": transcribe_options,
+                "batch_size": batch_size if use_batched else 1
+            }
+            
+            logger.info(f"Transcription completed. Language: {info.language}, Duration: {info.duration}s, Characters: {total_characters}, CPS: {characters_per_second:.2f}, Model: {loaded_model_size}")
+            
+            return ORJSONResponse(response_data)
         
-        return JSONResponse(content=response_data)
-    
-    except Exception as e:
-        logger.error(f"Transcription error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"변환 중 오류가 발생했습니다: {str(e)}")
-    
-    finally:
-        # 임시 파일 정리
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        if os.path.exists(temp_dir):
-            os.rmdir(temp_dir)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Transcription error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"변환 중 오류가 발생했습니다: {str(e)}")
 
 @app.post("/change_model")
-async def change_model(model_size: str):
-    """모델 변경"""
+async def change_model(model_size: str, compute_type: Optional[str] = None):
+    """모델 변경 (compute_type을 지정하지 않으면 저장된 설정 유지)"""
+    if compute_type is not None and compute_type not in COMPUTE_TYPES:
+        raise HTTPException(status_code=400, detail=f"지원하지 않는 compute_type입니다: {compute_type}")
+    
     try:
         # 활동 타이머 리셋
         reset_activity_timer()
         
-        load_model(model_size)
-        return {"message": f"Model changed to {model_size}", "current_model": model_size}
+        _, _, loaded_model_size = await asyncio.to_thread(load_model, model_size, "auto", compute_type)
+        return {"message": f"Model changed to {loaded_model_size}", "current_model": loaded_model_size, "compute_type": current_compute_type}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error changing model: {str(e)}")
 
@@ -409,65 +572,96 @@ async def get_status():
     return {
         "status": "running",
         "current_model": current_model_size,
-        "saved_model": load_settings(),
+        "compute_type": current_compute_type,
+        "saved_model": server_state["last_model"],
         "device": device,
         "cuda_available": torch.cuda.is_available(),
         "gpu_memory": gpu_memory_info,
+        "cuda_alloc_conf": os.environ.get("PYTORCH_CUDA_ALLOC_CONF"),
         "model_loaded": model is not None,
         "model_loading": model_loading,
-        "last_activity": last_activity_time,
-        "unload_scheduled": model_unload_timer is not None and model_unload_timer.is_alive()
+        "batch_size": DEFAULT_BATCH_SIZE,
+        "max_batch_size": MAX_BATCH_SIZE,
+        "num_workers": NUM_WORKERS,
+        "batched_inference": model is not None and current_device == "cuda",
+        "queue_length": pending_transcriptions,
+        "idle_seconds": round(time.monotonic() - last_activity_time, 1),
+        "unload_scheduled": model is not None and unload_watchdog_task is not None and not unload_watchdog_task.done()
     }
 
-# --- 다운로드 기능 추가 ---
-def format_timestamp(seconds: float, srt_format: bool = True) -> str:
-    """초 단위를 HH:MM:SS,mmm 또는 HH:MM:SS.mmm 형식으로 변환"""
-    assert seconds >= 0, "음수가 아닌 시간 값이 필요합니다"
-    milliseconds = round(seconds * 1000.0)
-
-    hours = milliseconds // 3_600_000
-    milliseconds %= 3_600_000
-
-    minutes = milliseconds // 60_000
-    milliseconds %= 60_000
-
-    seconds = milliseconds // 1_000
-    milliseconds %= 1_000
+@app.post("/debug/sync")
+async def debug_sync():
+    """GPU 작업 완료를 기다린 뒤 메모리 사용량 반환 (nvidia-smi 확인용, 언로드 경로에서는 동기화하지 않음)"""
+    if not torch.cuda.is_available():
+        return {"synchronized": False, "gpu_memory": {}}
     
-    separator = "," if srt_format else "."
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+    await asyncio.to_thread(torch.cuda.synchronize)
+    return {
+        "synchronized": True,
+        "gpu_memory": {
+            "allocated": torch.cuda.memory_allocated() // (1024**2),  # MB 단위
+            "cached": torch.cuda.memory_reserved() // (1024**2)       # MB 단위
+        }
+    }
 
-def generate_txt_content(segments: List[Dict[str, Any]], full_text: str, include_timestamps: bool) -> str:
-    if not include_timestamps:
-        return full_text
-    
-    lines = []
+# --- 다운로드 기능 추가 ---
+def format_srt_timestamp(milliseconds: int) -> str:
+    """밀리초 단위를 SRT 형식(HH:MM:SS,mmm)으로 변환"""
+    assert milliseconds >= 0, "음수가 아닌 시간 값이 필요합니다"
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1_000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+def format_vtt_timestamp(milliseconds: int) -> str:
+    """밀리초 단위를 VTT 형식(HH:MM:SS.mmm)으로 변환"""
+    assert milliseconds >= 0, "음수가 아닌 시간 값이 필요합니다"
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1_000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+# 세그먼트 수가 이보다 많으면 전체 내용을 메모리에 만들지 않고 스트리밍으로 다운로드
+STREAMING_SEGMENT_THRESHOLD = 1000
+STREAM_CHUNK_LINES = 256  # 스트리밍 시 한 번에 전송할 줄 수
+
+def iter_txt_lines(segments: List["SegmentData"]):
     for segment in segments:
-        start_time = format_timestamp(segment["start"], srt_format=False)
-        end_time = format_timestamp(segment["end"], srt_format=False)
-        lines.append(f"[{start_time} --> {end_time}] {segment['text']}")
-    return "\n".join(lines)
+        start_time = format_vtt_timestamp(round(segment.start * 1000))
+        end_time = format_vtt_timestamp(round(segment.end * 1000))
+        yield f"[{start_time} --> {end_time}] {segment.text}"
 
-def generate_srt_content(segments: List[Dict[str, Any]]) -> str:
-    lines = []
+def iter_srt_lines(segments: List["SegmentData"]):
     for i, segment in enumerate(segments):
-        start_time = format_timestamp(segment["start"], srt_format=True)
-        end_time = format_timestamp(segment["end"], srt_format=True)
-        lines.append(str(i + 1))
-        lines.append(f"{start_time} --> {end_time}")
-        lines.append(segment["text"])
-        lines.append("")  # 빈 줄 추가
-    return "\n".join(lines)
-
-def generate_vtt_content(segments: List[Dict[str, Any]]) -> str:
-    lines = ["WEBVTT", ""]
+        start_time = format_srt_timestamp(round(segment.start * 1000))
+        end_time = format_srt_timestamp(round(segment.end * 1000))
+        yield str(i + 1)
+        yield f"{start_time} --> {end_time}"
+        yield segment.text
+        yield ""  # 빈 줄 추가
+
+def iter_vtt_lines(segments: List["SegmentData"]):
+    yield "WEBVTT"
+    yield ""
     for segment in segments:
-        start_time = format_timestamp(segment["start"], srt_format=False)
-        end_time = format_timestamp(segment["end"], srt_format=False)
-        lines.append(f"{start_time} --> {end_time}")
-        lines.append(segment["text"])
-        lines.append("")  # 빈 줄 추가
-    return "\n".join(lines)
+        start_time = format_vtt_timestamp(round(segment.start * 1000))
+        end_time = format_vtt_timestamp(round(segment.end * 1000))
+        yield f"{start_time} --> {end_time}"
+        yield segment.text
+        yield ""  # 빈 줄 추가
+
+def iter_encoded_content(lines):
+    """줄 단위 출력을 UTF-8 청크로 인코딩합니다 (결과는 "\n".join(lines).encode()와 동일)."""
+    separator = ""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= STREAM_CHUNK_LINES:
+            yield (separator + "\n".join(buffer)).encode("utf-8")
+            separator = "\n"
+            buffer = []
+    if buffer:
+        yield (separator + "\n".join(buffer)).encode("utf-8")
 
 class SegmentData(BaseModel):
     start: float
@@ -482,21 +676,22 @@ class DownloadRequest(BaseModel):
     txt_include_timestamps: Optional[bool] = False # txt 형식일 경우 타임스탬프 포함 여부
     original_filename: Optional[str] = None # 원본 파일명
 
+# 파일명 처리용 정규식 (모듈 로드 시 한 번만 컴파일)
+# 위험한 문자(/ \ : * ? " < > |)와 제어 문자(ASCII 0-31)
+DANGEROUS_CHARS = re.compile(r'[/\\:*?"<>|\x00-\x1f]')
+MULTI_WHITESPACE = re.compile(r'\s+')
+ASCII_UNSAFE = re.compile(r'[^\x20-\x7E]')
+
 def sanitize_filename(filename: str) -> str:
     """파일명에서 위험한 문자만 제거하고 안전한 파일명으로 변환"""
     if not filename:
         return "transcription"
     
-    # 위험한 문자들만 제거 (파일시스템에서 문제가 되는 문자들)
-    # 제거할 문자: / \ : * ? " < > |
-    dangerous_chars = r'[/\\:*?"<>|]'
-    safe_filename = re.sub(dangerous_chars, '', filename)
-    
-    # 제어 문자 제거 (ASCII 0-31)
-    safe_filename = re.sub(r'[\x00-\x1f]', '', safe_filename)
+    # 위험한 문자들과 제어 문자 제거 (파일시스템에서 문제가 되는 문자들)
+    safe_filename = DANGEROUS_CHARS.sub('', filename)
     
     # 연속된 공백을 하나로 변경
-    safe_filename = re.sub(r'\s+', ' ', safe_filename)
+    safe_filename = MULTI_WHITESPACE.sub(' ', safe_filename)
     
     # 앞뒤 공백과 점 제거 (Windows에서 문제가 될 수 있음)
     safe_filename = safe_filename.strip(' .')
@@ -514,9 +709,9 @@ def sanitize_filename(filename: str) -> str:
 @app.post("/download")
 async def download_transcription(request_data: DownloadRequest = Body(...)):
     file_format = request_data.file_format.lower()
-    segments_as_dict = [segment.model_dump() for segment in request_data.segments]
 
     content = ""
+    lines = None
     media_type = "text/plain"
     
     # 디버깅을 위한 로그 추가
@@ -537,40 +732,49 @@ async def download_transcription(request_data: DownloadRequest = Body(...)):
     logger.info(f"Final filename: {filename}")
 
     if file_format == "txt":
-        content = generate_txt_content(segments_as_dict, request_data.full_text, request_data.txt_include_timestamps or False)
+        if request_data.txt_include_timestamps:
+            lines = iter_txt_lines(request_data.segments)
+        else:
+            content = request_data.full_text
     elif file_format == "srt":
-        content = generate_srt_content(segments_as_dict)
+        lines = iter_srt_lines(request_data.segments)
         media_type = "application/x-subrip"
     elif file_format == "vtt":
-        content = generate_vtt_content(segments_as_dict)
+        lines = iter_vtt_lines(request_data.segments)
         media_type = "text/vtt"
     else:
         raise HTTPException(status_code=400, detail="지원하지 않는 파일 형식입니다.")
 
-    if not content:
+    # 세그먼트가 많은 경우 스트리밍으로 전송하므로 전체 내용을 미리 만들지 않음
+    streaming = lines is not None and len(request_data.segments) > STREAMING_SEGMENT_THRESHOLD
+    if lines is not None and not streaming:
+        content = "\n".join(lines)
+
+    if not streaming and not content:
         raise HTTPException(status_code=500, detail="파일 내용 생성에 실패했습니다.")
         
-    # 문자열을 바이트 스트림으로 변환
-    stream = io.BytesIO(content.encode("utf-8"))
-    
     # 파일명을 안전하게 처리 (RFC 5987 표준 준수)
     # ASCII 안전한 파일명 생성 (fallback용)
-    ascii_filename = re.sub(r'[^\x20-\x7E]', '_', filename)
+    ascii_filename = ASCII_UNSAFE.sub('_', filename)
     # UTF-8 인코딩된 파일명
     encoded_filename = urllib.parse.quote(filename.encode('utf-8'))
     
     logger.info(f"ASCII filename: {ascii_filename}")
     logger.info(f"Encoded filename: {encoded_filename}")
     
-    return StreamingResponse(
-        stream,
-        media_type=media_type,
-        headers={
-            "Content-Disposition": f"attachment; filename=\"{ascii_filename}\"; filename*=UTF-8''{encoded_filename}"
-        }
-    )
+    headers = {
+        "Content-Disposition": f"attachment; filename=\"{ascii_filename}\"; filename*=UTF-8''{encoded_filename}"
+    }
+    
+    # 큰 자막은 청크 단위로 인코딩하여 스트리밍 (최대 메모리 사용량이 전체 크기와 무관)
+    if streaming:
+        return StreamingResponse(iter_encoded_content(lines), media_type=media_type, headers=headers)
+    
+    # 작은 내용은 스트리밍 없이 바로 반환 (Content-Length 설정됨)
+    return Response(content=content.encode("utf-8"), media_type=media_type, headers=headers)
 # --- 다운로드 기능 추가 완료 ---
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # 동시 요청 수를 제한하여 작업 스레드가 GPU를 과도하게 점유하지 않도록 함 (서비스 실행 명령은 README 참고)
+    uvicorn.run(app, host="0.0.0.0", port=8000, limit_concurrency=LIMIT_CONCURRENCY) 
\ No newline at end of file